@@ -1,7 +1,11 @@
 """图片智能拼接模块 - 将多张图片拼接成A4尺寸"""
 
+import os
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from io import BytesIO
+from typing import BinaryIO
 
 from PIL import Image
 
@@ -16,6 +20,19 @@ COLUMNS = 4  # 每行4列，每页只放1行
 CROP_TOP_PERCENT = 5  # 裁切顶部5%（状态栏）
 CROP_BOTTOM_PERCENT = 3  # 裁切底部3%（底部横条）
 
+# 缩放到单元格宽度的滤波器：缩小倍数不大，HAMMING 与 LANCZOS 效果相当但更快
+CELL_RESAMPLE = Image.Resampling.HAMMING
+# 传给 resize 的 reducing_gap：缩小倍数达到其两倍（即 3.5 倍）时，
+# Pillow 先按 倍数 // REDUCING_GAP 做整数倍盒式缩减（reduce），再做重采样，
+# 剩余缩小倍数不低于 REDUCING_GAP
+REDUCING_GAP = 1.75
+
+# 解码、缩放图片的线程数（Pillow 在这些操作中会释放 GIL）
+MAX_WORKERS = os.cpu_count() or 1
+
+# 图片来源：字节数据，或可 seek 的文件对象（如上传的临时文件）
+ImageSource = bytes | BinaryIO
+
 
 def _close_images(images: list[Image.Image]) -> None:
     """关闭图片列表中的所有图片"""
@@ -26,12 +43,16 @@ def _close_images(images: list[Image.Image]) -> None:
             pass
 
 
-def crop_phone_screenshot(img: Image.Image) -> Image.Image:
-    """裁切手机截图的状态栏和底部横条，关闭原图"""
-    width, height = img.size
+def _phone_crop_box(width: int, height: int) -> tuple[int, int, int, int]:
+    """计算去掉状态栏和底部横条后的裁切区域"""
     top = int(height * CROP_TOP_PERCENT / 100)
     bottom = int(height * (100 - CROP_BOTTOM_PERCENT) / 100)
-    cropped = img.crop((0, top, width, bottom))
+    return (0, top, width, bottom)
+
+
+def crop_phone_screenshot(img: Image.Image) -> Image.Image:
+    """裁切手机截图的状态栏和底部横条，关闭原图"""
+    cropped = img.crop(_phone_crop_box(*img.size))
     img.close()
     return cropped
 
@@ -49,12 +70,22 @@ class PlacedImage:
 class ImageStitcher:
     """图片拼接器 - 4列网格布局"""
 
-    def __init__(self, a4_width: int = A4_WIDTH, a4_height: int = A4_HEIGHT):
+    def __init__(
+        self,
+        a4_width: int = A4_WIDTH,
+        a4_height: int = A4_HEIGHT,
+        crop: bool = False
+    ):
         self.a4_width = a4_width
         self.a4_height = a4_height
         self.content_width = a4_width - 2 * PADDING
         self.content_height = a4_height - 2 * PADDING
         self.cell_width = (self.content_width - (COLUMNS - 1) * GAP) // COLUMNS
+        # 缩放时顺带裁切手机截图的状态栏和底部横条
+        self.crop = crop
+        # 预先算好每列的横坐标和行的纵坐标
+        self._col_x = tuple(PADDING + col * (self.cell_width + GAP) for col in range(COLUMNS))
+        self._row_y = PADDING + 60  # 下移一点点
 
     def stitch(self, images: list[Image.Image]) -> list[Image.Image]:
         """
@@ -66,17 +97,34 @@ class ImageStitcher:
         Returns:
             A4页面图片列表
         """
+        return list(self.iter_pages(images))
+
+    def iter_pages(self, images: list[Image.Image]) -> Iterator[Image.Image]:
+        """
+        逐页渲染A4页面，调用方处理完一页后即可关闭，不必同时持有所有页面
+
+        Args:
+            images: 待拼接的图片列表
+
+        Yields:
+            A4页面图片
+        """
         if not images:
-            return []
+            return
 
         # 缩放所有图片到单元格宽度
-        scaled_images = [self._fit_to_width(img, self.cell_width) for img in images]
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            scaled_images = list(executor.map(
+                lambda img: self._fit_to_width(img, self.cell_width, CELL_RESAMPLE),
+                images
+            ))
 
         # 网格布局
         pages = self._layout_images(scaled_images)
 
         # 渲染页面
-        return [self._render_page(page) for page in pages]
+        for page in pages:
+            yield self._render_page(page)
 
     def _layout_images(self, images: list[Image.Image]) -> list[list[PlacedImage]]:
         """4列布局，每页只放4张图片"""
@@ -87,11 +135,10 @@ class ImageStitcher:
             current_page: list[PlacedImage] = []
 
             for col, im in enumerate(row_images):
-                x = PADDING + col * (self.cell_width + GAP)
                 current_page.append(PlacedImage(
                     image=im,
-                    x=x,
-                    y=PADDING + 60,  # 下移一点点
+                    x=self._col_x[col],
+                    y=self._row_y,
                     width=im.width,
                     height=im.height
                 ))
@@ -100,13 +147,30 @@ class ImageStitcher:
 
         return pages
 
-    def _fit_to_width(self, img: Image.Image, target_width: int) -> Image.Image:
-        """缩放图片以适应目标宽度，关闭原图"""
-        if img.width == target_width:
-            return img
-        ratio = target_width / img.width
-        new_height = int(img.height * ratio)
-        resized = img.resize((target_width, new_height), Image.Resampling.LANCZOS)
+    def _fit_to_width(
+        self,
+        img: Image.Image,
+        target_width: int,
+        resample: Image.Resampling = Image.Resampling.LANCZOS
+    ) -> Image.Image:
+        """缩放图片以适应目标宽度（需要时同时裁切），关闭原图"""
+        box = _phone_crop_box(*img.size) if self.crop else None
+        # 宽度只差一两个像素（解码/裁切常见的误差）时不值得重新卷积
+        if abs(img.width - target_width) <= 2:
+            if box is None:
+                return img
+            return crop_phone_screenshot(img)
+
+        left, top, right, bottom = box or (0, 0, img.width, img.height)
+        ratio = target_width / (right - left)
+        new_height = int((bottom - top) * ratio)
+        # 裁切与缩放合并为一次卷积；缩小 3.5 倍以上时先用整数盒式缩减（reduce）预处理
+        resized = img.resize(
+            (target_width, new_height),
+            resample,
+            box=box,
+            reducing_gap=REDUCING_GAP
+        )
         img.close()
         return resized
 
@@ -114,101 +178,114 @@ class ImageStitcher:
         """渲染单个A4页面"""
         page = Image.new('RGB', (self.a4_width, self.a4_height), 'white')
 
+        # 加载时所有图片已统一转为RGB，直接粘贴即可
         for placed in placed_images:
-            img = placed.image
-            if img.mode != 'RGB':
-                converted = img.convert('RGB')
-                page.paste(converted, (placed.x, placed.y))
-                converted.close()
-            else:
-                page.paste(img, (placed.x, placed.y))
-            img.close()
+            page.paste(placed.image, (placed.x, placed.y))
+            placed.image.close()
 
         return page
 
 
-def _load_and_preprocess(image_bytes_list: list[bytes], crop: bool) -> list[Image.Image]:
-    """加载并预处理图片，调用方负责关闭返回的图片"""
-    images = []
-    try:
-        for data in image_bytes_list:
-            img = Image.open(BytesIO(data))
+def _load_one(data: ImageSource, min_width: int) -> Image.Image:
+    """加载单张图片并统一转换为RGB（透明部分填白）"""
+    img = Image.open(BytesIO(data) if isinstance(data, bytes) else data)
+    # JPEG 可在解码时按 1/2、1/4、1/8 缩小，只要结果不小于 min_width；其他格式忽略
+    img.draft('RGB', (min_width, min_width))
+    if img.mode == 'RGB':
+        return img
+
+    # 调色板透明、LA 等带透明度的模式先转成 RGBA，再以自身作为蒙版贴到白底上
+    if 'A' in img.getbands() or 'transparency' in img.info:
+        rgba = img.convert('RGBA') if img.mode != 'RGBA' else img
+        background = Image.new('RGB', img.size, 'white')
+        background.paste(rgba, (0, 0), rgba)
+        if rgba is not img:
+            rgba.close()
+    else:
+        background = img.convert('RGB')
+
+    img.close()
+    return background
 
-            if img.mode == 'RGBA':
-                background = Image.new('RGB', img.size, 'white')
-                background.paste(img, mask=img.split()[3])
-                img.close()
-                img = background
 
-            if crop:
-                img = crop_phone_screenshot(img)
+def _load_and_preprocess(
+    image_bytes_list: list[ImageSource], min_width: int
+) -> list[Image.Image]:
+    """多线程加载并预处理图片，调用方负责关闭返回的图片"""
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [executor.submit(_load_one, data, min_width) for data in image_bytes_list]
 
-            images.append(img)
+    images = []
+    error = None
+    for future in futures:
+        try:
+            images.append(future.result())
+        except Exception as e:
+            error = error or e
 
-        return images
-    except Exception:
+    if error is not None:
         _close_images(images)
-        raise
+        raise error
 
+    return images
 
-def stitch_images_to_a4(image_bytes_list: list[bytes], crop: bool = True) -> list[bytes]:
+
+def stitch_images_to_a4(image_bytes_list: list[ImageSource], crop: bool = True) -> list[bytes]:
     """
     便捷函数：将图片字节数据拼接成A4页面
 
     Args:
-        image_bytes_list: 图片字节数据列表
+        image_bytes_list: 图片字节数据或文件对象列表
         crop: 是否裁切手机截图的状态栏和底部横条
 
     Returns:
         A4页面的PNG字节数据列表
     """
-    images = _load_and_preprocess(image_bytes_list, crop)
-    pages = []
-
-    try:
-        stitcher = ImageStitcher()
-        pages = stitcher.stitch(images)
+    stitcher = ImageStitcher(crop=crop)
+    images = _load_and_preprocess(image_bytes_list, stitcher.cell_width * 2)
 
-        result = []
-        for page in pages:
+    result = []
+    for page in stitcher.iter_pages(images):
+        try:
             buffer = BytesIO()
             page.save(buffer, format='PNG', dpi=(300, 300))
             result.append(buffer.getvalue())
+        finally:
+            page.close()
 
-        return result
-    finally:
-        _close_images(pages)
+    return result
 
 
-def stitch_images_to_pdf(image_bytes_list: list[bytes], crop: bool = True) -> bytes:
+def stitch_images_to_pdf(image_bytes_list: list[ImageSource], crop: bool = True) -> bytes:
     """
     将图片拼接成A4页面并生成PDF
 
     Args:
-        image_bytes_list: 图片字节数据列表
+        image_bytes_list: 图片字节数据或文件对象列表
         crop: 是否裁切手机截图的状态栏和底部横条
 
     Returns:
         PDF文件字节数据
     """
-    images = _load_and_preprocess(image_bytes_list, crop)
-    pages = []
-
-    try:
-        stitcher = ImageStitcher()
-        pages = stitcher.stitch(images)
-
-        if not pages:
-            raise ValueError("没有生成任何页面")
-
-        buffer = BytesIO()
-        pages[0].save(
-            buffer,
-            format='PDF',
-            save_all=True,
-            append_images=pages[1:] if len(pages) > 1 else [],
-            resolution=300
-        )
-        return buffer.getvalue()
-    finally:
-        _close_images(pages)
+    stitcher = ImageStitcher(crop=crop)
+    images = _load_and_preprocess(image_bytes_list, stitcher.cell_width * 2)
+    buffer = BytesIO()
+    page_count = 0
+
+    # 逐页追加写入PDF，内存中同时只保留一张A4页面
+    for page in stitcher.iter_pages(images):
+        try:
+            page.save(
+                buffer,
+                format='PDF',
+                append=page_count > 0,
+                resolution=300
+            )
+        finally:
+            page.close()
+        page_count += 1
+
+    if page_count == 0:
+        raise ValueError("没有生成任何页面")
+
+    return buffer.getvalue()
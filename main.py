@@ -1,8 +1,13 @@
 """错题拼接打印服务"""
 
-import base64
+import zipfile
+from io import BytesIO
+from typing import BinaryIO
+
+import orjson
+import pybase64
 from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, Response
+from fastapi.responses import HTMLResponse, Response
 
 from image_stitcher import stitch_images_to_a4, stitch_images_to_pdf
 
@@ -21,34 +26,82 @@ def validate_image(filename: str, size: int) -> None:
         raise HTTPException(400, f"文件过大: {filename}")
 
 
-@app.post("/api/stitch")
-async def stitch_images(files: list[UploadFile] = File(...)):
+def _upload_size(file: UploadFile) -> int:
+    """获取上传文件大小，解析器未记录时通过 seek 计算"""
+    if file.size is not None:
+        return file.size
+    size = file.file.seek(0, 2)
+    file.file.seek(0)
+    return size
+
+
+def _collect_uploads(files: list[UploadFile]) -> list[BinaryIO]:
     """
-    上传多张图片，拼接成A4页面
+    验证所有上传文件并返回其底层文件对象
 
-    Returns:
-        JSON包含base64编码的图片列表
+    不把内容读成 bytes，由 Pillow 直接从临时文件读取，避免整份拷贝进内存
     """
+    for file in files:
+        validate_image(file.filename or "unknown", _upload_size(file))
+    return [file.file for file in files]
+
+
+def _stitch_uploads(files: list[UploadFile]) -> list[bytes]:
+    """验证上传文件并拼接成A4页面，返回PNG字节数据列表"""
     if not files:
         raise HTTPException(400, "请上传至少一张图片")
 
-    image_bytes_list = []
-    for file in files:
-        content = await file.read()
-        validate_image(file.filename or "unknown", len(content))
-        image_bytes_list.append(content)
+    image_files = _collect_uploads(files)
 
     try:
-        pages = stitch_images_to_a4(image_bytes_list)
+        pages = stitch_images_to_a4(image_files)
     except Exception as e:
         raise HTTPException(500, f"图片处理失败: {str(e)}")
 
     if not pages:
         raise HTTPException(500, "生成页面失败")
 
-    # 返回base64编码的图片列表
-    images_base64 = [base64.b64encode(page).decode('utf-8') for page in pages]
-    return JSONResponse({"pages": images_base64})
+    return pages
+
+
+@app.post("/api/stitch")
+async def stitch_images(files: list[UploadFile] = File(...)):
+    """
+    上传多张图片，拼接成A4页面
+
+    Returns:
+        JSON包含base64编码的图片列表
+    """
+    pages = _stitch_uploads(files)
+
+    # 返回base64编码的图片列表，用 orjson 序列化多 MB 的字符串
+    images_base64 = [pybase64.b64encode(page).decode('utf-8') for page in pages]
+    return Response(
+        content=orjson.dumps({"pages": images_base64}),
+        media_type="application/json"
+    )
+
+
+@app.post("/api/stitch/bin")
+async def stitch_images_bin(files: list[UploadFile] = File(...)):
+    """
+    上传多张图片，拼接成A4页面，以ZIP打包返回PNG原始数据
+
+    相比 /api/stitch 省去 base64 编码，响应体约小三分之一
+    """
+    pages = _stitch_uploads(files)
+
+    # PNG 本身已压缩，ZIP 只做存储不再压缩
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zf:
+        for i, page in enumerate(pages, 1):
+            zf.writestr(f"page_{i}.png", page)
+
+    return Response(
+        content=buffer.getvalue(),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=pages.zip"}
+    )
 
 
 @app.post("/api/stitch/pdf")
@@ -59,14 +112,10 @@ async def stitch_images_pdf(files: list[UploadFile] = File(...)):
     if not files:
         raise HTTPException(400, "请上传至少一张图片")
 
-    image_bytes_list = []
-    for file in files:
-        content = await file.read()
-        validate_image(file.filename or "unknown", len(content))
-        image_bytes_list.append(content)
+    image_files = _collect_uploads(files)
 
     try:
-        pdf_data = stitch_images_to_pdf(image_bytes_list)
+        pdf_data = stitch_images_to_pdf(image_files)
     except Exception as e:
         raise HTTPException(500, f"PDF生成失败: {str(e)}")
 
@@ -77,10 +126,7 @@ async def stitch_images_pdf(files: list[UploadFile] = File(...)):
     )
 
 
-@app.get("/", response_class=HTMLResponse)
-async def index():
-    """返回前端页面"""
-    return """<!DOCTYPE html>
+INDEX_HTML = """<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
     <meta charset="UTF-8">
@@ -376,6 +422,15 @@ async def index():
 </body>
 </html>"""
 
+# 前端页面只在启动时编码一次，每次请求直接返回字节
+INDEX_HTML_BYTES = INDEX_HTML.encode('utf-8')
+
+
+@app.get("/", response_class=HTMLResponse)
+async def index():
+    """返回前端页面"""
+    return HTMLResponse(content=INDEX_HTML_BYTES)
+
 
 if __name__ == "__main__":
     import uvicorn